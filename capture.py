@@ -0,0 +1,224 @@
+import itertools
+import os
+import struct
+
+import codes
+
+# Frame header: arrival timestamp, session id, connection id, server handling duration, response code,
+# raw request data length, response payload length
+FRAME_HEADER_FORMAT = "<dIIdHII"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+
+
+class CapturedFrame:
+    """
+    A single request frame read by the server from a client connection, along with the server's response.
+    A frame with no data marks the closing of the connection.
+    """
+    def __init__(self, timestamp, session_id, connection_id, duration, response_code, data, response_payload):
+        """
+        Constructor.
+        :param timestamp: time the frame's first bytes became readable on the server (seconds since the epoch)
+        :param session_id: id of the server run that recorded the frame
+        :param connection_id: id of the connection the frame was read from, unique within the session
+        :param duration: time the server spent handling the frame, excluding waiting for the client (seconds)
+        :param response_code: code of the response returned for the frame, 0 if no response was returned
+        :param data: raw bytes read from the connection
+        :param response_payload: payload of the response, kept only for registration responses
+        """
+        self.timestamp = timestamp
+        self.session_id = session_id
+        self.connection_id = connection_id
+        self.duration = duration
+        self.response_code = response_code
+        self.data = data
+        self.response_payload = response_payload
+
+    def get_timestamp(self):
+        return self.timestamp
+
+    def get_session_id(self):
+        return self.session_id
+
+    def get_connection_id(self):
+        return self.connection_id
+
+    def get_duration(self):
+        return self.duration
+
+    def get_response_code(self):
+        return self.response_code
+
+    def get_data(self):
+        return self.data
+
+    def get_response_payload(self):
+        return self.response_payload
+
+    def is_close(self):
+        return not self.data
+
+    def pack(self):
+        """
+        Packs the frame into a little endian representation.
+        :return: packed frame
+        """
+        return struct.pack(FRAME_HEADER_FORMAT, self.timestamp, self.session_id, self.connection_id, self.duration,
+                           self.response_code, len(self.data), len(self.response_payload)) \
+            + self.data + self.response_payload
+
+
+class RecordingConnection:
+    """
+    Wraps a client connection and keeps a copy of every byte read from it.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.data = b""
+
+    def recv(self, size):
+        chunk = self.connection.recv(size)
+        self.data += chunk
+        return chunk
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def get_data(self):
+        return self.data
+
+
+class CaptureWriter:
+    """
+    Appends the request frames read by the server to a capture file.
+    """
+    def __init__(self, path):
+        """
+        Constructor.
+        :param path: path of the capture file, frames are appended as a new session if it already exists
+        """
+        # Connection ids restart on every run, so tell the runs apart with a session id
+        self.session_id = get_last_session_id(path) + 1
+
+        self.file = open(path, "ab")
+        self.connection_ids = {}
+        self.id_counter = itertools.count(1)
+
+        # Holds the parts of requests whose payload is still arriving: connection -> (timestamp, duration, data)
+        self.partial_frames = {}
+
+    def get_connection_id(self, connection):
+        """
+        Retrieves the id of a connection, assigning a new one the first time the connection is seen.
+        :param connection: connection to client
+        :return: connection id
+        """
+        if connection not in self.connection_ids:
+            self.connection_ids[connection] = next(self.id_counter)
+        return self.connection_ids[connection]
+
+    def record_partial(self, connection, timestamp, duration, data):
+        """
+        Keeps the part of a request that was read so far, until the rest of it arrives.
+        :param connection: connection the part was read from
+        :param timestamp: time the part became readable
+        :param duration: time spent handling the part
+        :param data: raw bytes read from the connection
+        :return: None
+        """
+        if connection in self.partial_frames:
+            first_timestamp, previous_duration, previous_data = self.partial_frames[connection]
+            self.partial_frames[connection] = (first_timestamp, previous_duration + duration, previous_data + data)
+        else:
+            self.partial_frames[connection] = (timestamp, duration, data)
+
+    def record(self, connection, timestamp, duration, data, response):
+        """
+        Appends a frame to the capture file, along with the previously read parts of the request.
+        :param connection: connection the frame was read from
+        :param timestamp: time the frame became readable
+        :param duration: time spent handling the frame
+        :param data: raw bytes read from the connection, empty if the connection was closed
+        :param response: Response returned for the frame, None if no response was returned
+        :return: None
+        """
+        self.record_partial(connection, timestamp, duration, data)
+        timestamp, duration, data = self.partial_frames.pop(connection)
+
+        response_code = response.get_code() if response else 0
+
+        # Only the ids assigned on registration are needed for replaying, keep the file compact otherwise
+        if response_code == codes.REGISTRATION_SUCCESSFUL_RESPONSE:
+            response_payload = response.get_payload()
+        else:
+            response_payload = b""
+
+        frame = CapturedFrame(timestamp, self.session_id, self.get_connection_id(connection), duration,
+                              response_code, data, response_payload)
+        self.file.write(frame.pack())
+        self.file.flush()
+
+    def forget(self, connection):
+        """
+        Releases a closed connection, since connection objects may be reused after being closed.
+        :param connection: closed connection to client
+        :return: None
+        """
+        self.connection_ids.pop(connection, None)
+        self.partial_frames.pop(connection, None)
+
+    def close(self):
+        self.file.close()
+
+
+def get_last_session_id(path):
+    """
+    Finds the id of the last session recorded in a capture file, reading only the frames' headers.
+    :param path: path of the capture file
+    :return: last session id, 0 if the file doesn't exist or is empty
+    """
+    session_id = 0
+
+    if not os.path.exists(path):
+        return session_id
+
+    with open(path, "rb") as file:
+        while True:
+            header = file.read(FRAME_HEADER_SIZE)
+
+            if len(header) < FRAME_HEADER_SIZE:
+                break
+            _, frame_session_id, _, _, _, data_size, response_payload_size = struct.unpack(FRAME_HEADER_FORMAT, header)
+            session_id = max(session_id, frame_session_id)
+
+            # Skip the frame's data
+            file.seek(data_size + response_payload_size, os.SEEK_CUR)
+
+    return session_id
+
+
+def read_capture(path):
+    """
+    Reads all the frames saved in a capture file.
+    :param path: path of the capture file
+    :return: list of CapturedFrame ordered as they were recorded
+    """
+    frames = []
+
+    with open(path, "rb") as file:
+        while True:
+            header = file.read(FRAME_HEADER_SIZE)
+
+            if len(header) < FRAME_HEADER_SIZE:  # End of file, or a frame truncated while being written
+                break
+            timestamp, session_id, connection_id, duration, response_code, data_size, response_payload_size = \
+                struct.unpack(FRAME_HEADER_FORMAT, header)
+            data = file.read(data_size)
+            response_payload = file.read(response_payload_size)
+
+            if len(data) < data_size or len(response_payload) < response_payload_size:
+                break
+            frames.append(CapturedFrame(timestamp, session_id, connection_id, duration, response_code, data,
+                                        response_payload))
+
+    return frames
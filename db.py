@@ -9,6 +9,9 @@ MESSAGES_TABLE_NAME = "messages"
 # Queries
 IS_TABLE_EXISTS_QUERY = "SELECT name FROM sqlite_master WHERE type='table' AND name=?"
 
+# Maximum number of parameters allowed in a single sqlite query
+MAX_QUERY_PARAMETERS = 999
+
 
 class DBConnection:
     """
@@ -96,6 +99,28 @@ class DBConnection:
 
         return Client(*result[0])
 
+    def get_clients_by_ids(self, client_ids):
+        """
+        Retrieves the clients from the clients table according to the given ids.
+        :param client_ids: list of client ids
+        :return: dict mapping the id of each found client to the client
+        """
+        print(f"Retrieving {len(client_ids)} clients by id")
+        cursor = self.connection.cursor()
+        clients = {}
+
+        # Query in chunks to stay within sqlite's parameters limit
+        for i in range(0, len(client_ids), MAX_QUERY_PARAMETERS):
+            ids_chunk = client_ids[i:i + MAX_QUERY_PARAMETERS]
+            query = f"SELECT * FROM {CLIENTS_TABLE_NAME} WHERE ID IN (%s)" % ','.join(['?'] * len(ids_chunk))
+            for row in cursor.execute(query, ids_chunk).fetchall():
+                client = Client(*row)
+                clients[client.get_id()] = client
+
+        print(f"Retrieved {len(clients)} out of {len(client_ids)} requested clients")
+
+        return clients
+
     def get_client_by_name(self, client_name):
         """
         Retrieves a client from the clients table according to the given name.
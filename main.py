@@ -1,6 +1,10 @@
+import sys
+
 from server import Server
 
 if __name__ == "__main__":
-    server = Server()
-    server.start()
+    # An optional argument sets the file to record the incoming traffic to
+    capture_path = sys.argv[1] if len(sys.argv) > 1 else None
 
+    server = Server(capture_path=capture_path)
+    server.start()
@@ -0,0 +1,360 @@
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import codes
+import sizes
+from capture import read_capture
+from server import Server
+
+# Response header: version, code, payload size
+RESPONSE_HEADER_FORMAT = "<BHI"
+RESPONSE_HEADER_SIZE = struct.calcsize(RESPONSE_HEADER_FORMAT)
+
+# How long to wait for the replay server to start accepting connections (seconds)
+SERVER_STARTUP_TIMEOUT = 10
+
+# How long to wait for the replay server to finish recording the replayed requests (seconds)
+CAPTURE_FLUSH_TIMEOUT = 2
+
+
+def find_free_port():
+    """
+    Finds a local port that is not in use.
+    :return: port number
+    """
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_replay_server(port, db_name, capture_path):
+    """
+    Starts a server in a background thread and waits until it accepts connections.
+    :param port: port for the server to listen on
+    :param db_name: name of the server's db
+    :param capture_path: path of the file the server records the replayed traffic to
+    :return: None
+    """
+    ready = threading.Event()
+
+    # The server must be created in its own thread, since the sqlite connection is bound to the creating thread
+    def run():
+        Server(port, db_name, capture_path).start(ready)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    if not ready.wait(SERVER_STARTUP_TIMEOUT):
+        raise ValueError(f"Replay server did not start on port {port}")
+
+
+def receive_exactly(sock, size):
+    """
+    Reads an exact number of bytes from a socket.
+    :param sock: socket to read from
+    :param size: number of bytes to read
+    :return: bytes read, fewer than requested if the socket was closed
+    """
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def get_frame_offsets(frames):
+    """
+    Computes the time of each frame relative to the start of the capture, skipping the downtime between sessions.
+    :param frames: captured frames, in capture order
+    :return: list of offsets (seconds), one per frame
+    """
+    offsets = []
+    elapsed = 0
+    session_id = None
+    session_start = session_end = 0
+
+    for frame in frames:
+        if frame.get_session_id() != session_id:
+            # A new server run, continue right after the end of the previous one
+            elapsed += session_end - session_start
+            session_id = frame.get_session_id()
+            session_start = session_end = frame.get_timestamp()
+
+        offsets.append(elapsed + frame.get_timestamp() - session_start)
+        session_end = max(session_end, frame.get_timestamp() + frame.get_duration())
+
+    return offsets
+
+
+class Replayer:
+    """
+    Re-drives captured frames against a running server, one client socket per captured connection.
+    Client ids assigned by the server during the capture are mapped to the ids assigned during the replay.
+    """
+    def __init__(self, port, speed):
+        """
+        Constructor.
+        :param port: port of the server
+        :param speed: replay speed factor, 1 replays at the original speed
+        """
+        self.port = port
+        self.speed = speed
+
+        # Notified whenever a captured registration is resolved during the replay
+        self.registrations_resolved = threading.Condition()
+
+        # Client ids assigned on registration during the capture
+        self.registered_ids = set()
+
+        # Maps the client ids registered during the capture to the ones registered during the replay
+        self.client_ids = {}
+
+        # Number of replayed frames whose response code differs from the captured one
+        self.mismatches = 0
+
+    def replay(self, frames):
+        """
+        Replays the captured frames.
+        :param frames: captured frames
+        :return: None
+        """
+        self.registered_ids = {frame.get_response_payload() for frame in frames
+                               if frame.get_response_code() == codes.REGISTRATION_SUCCESSFUL_RESPONSE}
+
+        connections = {}
+        for offset, frame in zip(get_frame_offsets(frames), frames):
+            key = (frame.get_session_id(), frame.get_connection_id())
+            connections.setdefault(key, []).append((offset, frame))
+
+        # Start each connection only when its first frame is due, so idle connections don't hold threads
+        start_time = time.time()
+        threads = []
+
+        for connection_frames in sorted(connections.values(), key=lambda connection: connection[0][0]):
+            delay = start_time + connection_frames[0][0] / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            thread = threading.Thread(target=self.replay_connection, args=(connection_frames, start_time))
+            thread.start()
+            threads = [thread for thread in threads if thread.is_alive()] + [thread]
+
+        for thread in threads:
+            thread.join()
+
+    def replay_connection(self, frames, start_time):
+        """
+        Re-sends the frames of a single captured connection at their original (scaled) times.
+        :param frames: list of (offset, frame) of the connection, in capture order
+        :param start_time: time the replay started
+        :return: None
+        """
+        sock = None
+        try:
+            for offset, frame in frames:
+                # Wait until the frame's scheduled time
+                delay = start_time + offset / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+                if frame.is_close():
+                    break
+
+                # Waits for the registrations of the clients the frame refers to, which may be replayed on other
+                # connections
+                data = self.map_client_ids(frame.get_data())
+
+                if not sock:
+                    sock = socket.create_connection(("localhost", self.port))
+                sock.sendall(data)
+
+                # Wait for the response before sending the next frame, as the original client did
+                header = receive_exactly(sock, RESPONSE_HEADER_SIZE)
+                if len(header) < RESPONSE_HEADER_SIZE:
+                    # The server closed the connection, which is only expected if it did so in the capture too
+                    if frame.get_response_code():
+                        self.add_mismatch()
+                    break
+                code, payload_size = struct.unpack(RESPONSE_HEADER_FORMAT, header)[1:]
+                payload = receive_exactly(sock, payload_size)
+
+                if code != frame.get_response_code():
+                    self.add_mismatch()
+
+                    # Don't hold back the frames of a client that failed registering, they keep the captured id
+                    if frame.get_response_code() == codes.REGISTRATION_SUCCESSFUL_RESPONSE:
+                        self.resolve_registration(frame.get_response_payload(), frame.get_response_payload())
+                elif code == codes.REGISTRATION_SUCCESSFUL_RESPONSE:
+                    self.resolve_registration(frame.get_response_payload(), payload)
+        except OSError as e:
+            print("Replayed connection failed:", e)
+        finally:
+            if sock:
+                sock.close()
+
+            # Release frames waiting for registrations that weren't replayed, they keep the captured ids
+            for offset, frame in frames:
+                if frame.get_response_code() == codes.REGISTRATION_SUCCESSFUL_RESPONSE:
+                    self.resolve_registration(frame.get_response_payload(), frame.get_response_payload())
+
+    def resolve_registration(self, captured_id, replayed_id):
+        """
+        Records the id assigned during the replay to a client registered during the capture.
+        :param captured_id: client id assigned during the capture
+        :param replayed_id: client id assigned during the replay
+        :return: None
+        """
+        with self.registrations_resolved:
+            self.client_ids.setdefault(captured_id, replayed_id)
+            self.registrations_resolved.notify_all()
+
+    def map_client_ids(self, data):
+        """
+        Replaces the captured client ids in a request with the ids registered during the replay.
+        Waits until the registrations of all the ids in the request are resolved.
+        :param data: raw request bytes
+        :return: request bytes to send
+        """
+        if not self.registered_ids:
+            return data
+
+        captured_ids = {data[i:i + sizes.CLIENT_ID_SIZE]
+                        for i in range(len(data) - sizes.CLIENT_ID_SIZE + 1)} & self.registered_ids
+
+        with self.registrations_resolved:
+            self.registrations_resolved.wait_for(lambda: captured_ids.issubset(self.client_ids))
+            client_ids = [(captured_id, self.client_ids[captured_id]) for captured_id in captured_ids]
+
+        for captured_id, replayed_id in client_ids:
+            data = data.replace(captured_id, replayed_id)
+        return data
+
+    def add_mismatch(self):
+        with self.registrations_resolved:
+            self.mismatches += 1
+
+    def get_mismatches(self):
+        return self.mismatches
+
+
+def read_replay_capture(path, expected_requests):
+    """
+    Reads the capture recorded by the replay server, waiting for the last responses to be recorded.
+    :param path: path of the replay server's capture file
+    :param expected_requests: number of requests that were replayed
+    :return: list of CapturedFrame
+    """
+    # The server records a frame only after sending its response, so the last frames may still be in flight
+    deadline = time.time() + CAPTURE_FLUSH_TIMEOUT
+    while True:
+        frames = read_capture(path)
+        if len([frame for frame in frames if not frame.is_close()]) >= expected_requests or time.time() > deadline:
+            return frames
+        time.sleep(0.05)
+
+
+def summarize(frames):
+    """
+    Computes throughput, latency and response statistics of the request frames in a capture.
+    :param frames: captured frames
+    :return: dict of statistics, latencies are in milliseconds
+    """
+    requests = [(offset, frame) for offset, frame in zip(get_frame_offsets(frames), frames) if not frame.is_close()]
+    if not requests:
+        return None
+
+    latencies = sorted(frame.get_duration() * 1000 for offset, frame in requests)
+    span = max(offset + frame.get_duration() for offset, frame in requests) - requests[0][0]
+
+    response_codes = {}
+    for offset, frame in requests:
+        response_codes[frame.get_response_code()] = response_codes.get(frame.get_response_code(), 0) + 1
+
+    return {
+        "requests": len(requests),
+        "errors": response_codes.get(codes.GENERAL_ERROR, 0),
+        "throughput": len(requests) / span if span > 0 else float("inf"),
+        "mean": sum(latencies) / len(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "max": latencies[-1],
+        "response_codes": response_codes,
+    }
+
+
+def print_report(original, replayed, mismatches):
+    """
+    Prints the statistics of the original and replayed traffic side by side.
+    :param original: statistics of the captured traffic
+    :param replayed: statistics of the replayed traffic
+    :param mismatches: number of replayed requests whose response code differs from the captured one
+    :return: None
+    """
+    print(f"{'':<20}{'original':>12}{'replay':>12}{'diff':>12}")
+    for name, unit in [("requests", ""), ("errors", ""), ("throughput", "req/s"), ("mean", "ms"), ("p50", "ms"),
+                       ("p95", "ms"), ("max", "ms")]:
+        label = f"{name} ({unit})" if unit else name
+        diff = replayed[name] - original[name]
+        print(f"{label:<20}{original[name]:>12.3f}{replayed[name]:>12.3f}{diff:>+12.3f}")
+
+    # Timings are only comparable if the server took the same paths in both runs
+    for code in sorted(set(original["response_codes"]) | set(replayed["response_codes"])):
+        original_count = original["response_codes"].get(code, 0)
+        replayed_count = replayed["response_codes"].get(code, 0)
+        print(f"{f'response {code}':<20}{original_count:>12}{replayed_count:>12}{replayed_count - original_count:>+12}")
+
+    print(f"Mismatched responses: {mismatches} out of {original['requests']}")
+    if mismatches or original["response_codes"] != replayed["response_codes"]:
+        print("WARNING: the replay diverged from the captured traffic, the timings are not comparable")
+
+
+def main(capture_path, seed_db_path, speed=1.0):
+    """
+    Replays a capture against a fresh server started on a copy of the seed DB and reports the differences.
+    The seed DB should be a snapshot of the server's DB taken when the capture started, so that the captured
+    requests refer to existing clients.
+    :param capture_path: path of the capture file
+    :param seed_db_path: path of the DB to start the replay server with
+    :param speed: replay speed factor, e.g. 2 replays twice as fast as the original traffic
+    :return: None
+    """
+    frames = read_capture(capture_path)
+    original = summarize(frames)
+    if not original:
+        raise ValueError(f"No requests found in capture: {capture_path}")
+
+    # The replay server keeps its files open until the process exits
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as work_dir:
+        # Work on copies so the seed DB can be reused across replays
+        db_name = os.path.join(work_dir, "replay.db")
+        replay_capture_path = os.path.join(work_dir, "replay.capture")
+        shutil.copyfile(seed_db_path, db_name)
+
+        port = find_free_port()
+        start_replay_server(port, db_name, replay_capture_path)
+
+        print(f"Replaying {original['requests']} requests at x{speed} speed...")
+        replayer = Replayer(port, speed)
+        replayer.replay(frames)
+
+        # The replay server records the replayed traffic, giving server side timings comparable to the original
+        replayed = summarize(read_replay_capture(replay_capture_path, original["requests"]))
+
+    if not replayed:
+        raise ValueError("No requests were replayed")
+    print_report(original, replayed, replayer.get_mismatches())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python replay.py <capture file> <seed db> [speed]")
+        sys.exit(1)
+
+    main(sys.argv[1], sys.argv[2], float(sys.argv[3]) if len(sys.argv) == 4 else 1.0)
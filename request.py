@@ -17,3 +17,6 @@ class Request:
 
     def get_payload(self):
         return self.payload
+
+    def set_payload(self, payload):
+        self.payload = payload
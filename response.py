@@ -14,6 +14,12 @@ class Response:
         # Holds messages that should be deleted after the response is sent
         self.messages_to_delete = None
 
+    def get_code(self):
+        return self.code
+
+    def get_payload(self):
+        return self.payload
+
     def get_messages_to_delete(self):
         return self.messages_to_delete
 
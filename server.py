@@ -1,6 +1,7 @@
 import socket
 import selectors
 import struct
+import time
 import uuid
 
 import codes
@@ -10,6 +11,7 @@ from request import Request
 from response import Response
 from client import Client
 from message import Message
+from capture import CaptureWriter, RecordingConnection
 
 # Server port file path
 SERVER_PORT_PATH = "port.info"
@@ -21,29 +23,58 @@ SERVER_VERSION = 2
 # Maximum allowed number of connections by the server
 MAX_CONNECTIONS_ALLOWED = 100
 
+# Get public keys response entry: client id, found flag, public key
+PUBLIC_KEY_ENTRY_FORMAT = struct.Struct(f"<{sizes.CLIENT_ID_SIZE}sB{sizes.PUBLIC_KEY_SIZE}s")
+
 
 # TODO: make sure the client is registered before requesting anything, both in the client and in the server
 
 
 class Server:
-    def __init__(self):
+    def __init__(self, port=None, db_name=SERVER_DB_NAME, capture_path=None):
+        """
+        Constructor.
+        :param port: port to listen on, read from the port file if not given
+        :param db_name: name of the server's db
+        :param capture_path: path of a file to record the incoming request frames to, no recording if not given
+        """
         # Get the server's port number
-        try:
-            self.port = self.read_port()
-        except Exception as e:
-            raise ValueError("Failed reading port number", e)
+        if port:
+            self.port = port
+        else:
+            try:
+                self.port = self.read_port()
+            except Exception as e:
+                raise ValueError("Failed reading port number", e)
 
         # Define a selector to handle multiple connections
         self.selector = selectors.DefaultSelector()
 
+        # Holds requests whose payload is still arriving by their connection's file descriptor, so they can be
+        # resumed on the next read
+        self.pending_requests = {}
+
         # Create a DB client
         try:
-            self.db = DBConnection(SERVER_DB_NAME)
+            self.db = DBConnection(db_name)
         except Exception as e:
             raise ValueError("DB error", e)
 
-    def start(self):
+        # Create a writer for recording the incoming traffic
+        if capture_path:
+            try:
+                self.capture = CaptureWriter(capture_path)
+            except Exception as e:
+                raise ValueError("Failed opening capture file", e)
+        else:
+            self.capture = None
 
+    def start(self, ready=None):
+        """
+        Starts accepting and handling connections.
+        :param ready: optional threading.Event, set once the server listens for connections
+        :return: None
+        """
         # Set up a socket for accepting connections
         sock = socket.socket()
         sock.bind(("localhost", self.port))
@@ -51,6 +82,9 @@ class Server:
         sock.setblocking(False)
         self.selector.register(sock, selectors.EVENT_READ, self.accept)
 
+        if ready:
+            ready.set()
+
         # Receive connections
         print("Waiting for incoming connections...")
         while True:
@@ -71,34 +105,100 @@ class Server:
         self.selector.register(connection, selectors.EVENT_READ, self.read)
 
     def read(self, connection, mask):
+        # Keep a copy of the bytes read from the connection when recording the traffic
+        if self.capture:
+            request_connection = RecordingConnection(connection)
+            request_timestamp = time.time()
+            request_start_time = time.perf_counter()
+        else:
+            request_connection = connection
+
         try:
-            response = self.handle_request(connection)
+            response = self.handle_request(request_connection)
         except Exception as e:
             print("Error occurred while handling request:", e)
             response = Response(SERVER_VERSION, codes.GENERAL_ERROR, 0, None)
 
+        # Wait for the rest of the request without blocking the other connections
+        if connection.fileno() in self.pending_requests:
+            if self.capture:
+                self.record_partial_request(connection, request_timestamp, time.perf_counter() - request_start_time,
+                                            request_connection.get_data())
+            return
+
         # TODO handle disconnection
+        closed = False
         if response:
             try:
                 print(f"Returning response: {response} to: {connection}")
                 connection.sendall(response.pack())
             except Exception as e:
                 print(f"Unable to send response due to {e}, closing: {connection}")
-                self.selector.unregister(connection)
-                connection.close()
+                self.close_connection(connection)
+                closed = True
         else:
             print("Closing:", connection)
-            self.selector.unregister(connection)
-            connection.close()
+            self.close_connection(connection)
+            closed = True
 
         # Clean data from the server after sending a response
         self.clean_after_response(response)
 
+        if self.capture:
+            self.record_request(connection, request_timestamp, time.perf_counter() - request_start_time,
+                                request_connection.get_data(), response, closed)
+
+    def close_connection(self, connection):
+        """
+        Closes a connection to a client, discarding its partially received request.
+        :param connection: connection to client
+        :return: None
+        """
+        self.pending_requests.pop(connection.fileno(), None)
+        self.selector.unregister(connection)
+        connection.close()
+
+    def record_partial_request(self, connection, timestamp, duration, data):
+        """
+        Records the part of a request read so far, it is written to the capture file once the request is complete.
+        :param connection: connection to client
+        :param timestamp: time the part became readable
+        :param duration: time spent handling the part
+        :param data: raw bytes read from the connection
+        :return: None
+        """
+        try:
+            self.capture.record_partial(connection, timestamp, duration, data)
+        except Exception as e:
+            print("Failed recording request:", e)
+
+    def record_request(self, connection, timestamp, duration, data, response, closed):
+        """
+        Records a handled request in the capture file. Recording failures don't affect the request handling.
+        :param connection: connection to client
+        :param timestamp: time the request became readable
+        :param duration: time spent handling the request
+        :param data: raw bytes read from the connection
+        :param response: Response returned to the client, None if no response was returned
+        :param closed: whether the connection was closed
+        :return: None
+        """
+        try:
+            self.capture.record(connection, timestamp, duration, data, response)
+        except Exception as e:
+            print("Failed recording request:", e)
+
+        if closed:
+            self.capture.forget(connection)
+
     def handle_request(self, connection):
 
-        # Read the request from the socket
+        # Resume a request whose payload was still arriving, or read a new request from the socket
         # try:
-        request = self.read_request(connection)
+        if connection.fileno() in self.pending_requests:
+            request = self.pending_requests.pop(connection.fileno())
+        else:
+            request = self.read_request(connection)
 
         if not request:
             return None
@@ -117,6 +217,9 @@ class Server:
         elif code == codes.GET_CLIENT_PUBLIC_KEY_REQUEST:  # Get a client's public key
             response = self.get_client_public_key(request, connection)
 
+        elif code == codes.GET_CLIENTS_PUBLIC_KEYS_REQUEST:  # Get several clients' public keys
+            response = self.get_clients_public_keys(request, connection)
+
         elif code == codes.SEND_CLIENT_MESSAGE_REQUEST:  # Send client a message
             response = self.send_client_message(request, connection)
 
@@ -157,6 +260,34 @@ class Server:
 
         return Request(client_id, client_version, code, payload_size, payload)
 
+    def receive_payload(self, request, connection):
+        """
+        Reads the part of the request's payload that is available on the socket without waiting for the rest.
+        If the payload is incomplete, the request is kept so it can be resumed once more data arrives.
+        :param request: Request whose payload to read
+        :param connection: socket connection to client.
+        :return: True if the whole payload was received, False otherwise
+        """
+        payload = request.get_payload() or b""
+
+        while len(payload) < request.get_payload_size():
+            try:
+                chunk = connection.recv(request.get_payload_size() - len(payload))
+            except BlockingIOError:  # The rest of the payload hasn't arrived yet
+                break
+
+            if not chunk:
+                raise ValueError(f"Connection closed after receiving {len(payload)} out of "
+                                 f"{request.get_payload_size()} payload bytes")
+            payload += chunk
+
+        request.set_payload(payload)
+
+        if len(payload) < request.get_payload_size():
+            self.pending_requests[connection.fileno()] = request
+            return False
+        return True
+
     @staticmethod
     def read_port():
         """
@@ -263,6 +394,52 @@ class Server:
         return Response(SERVER_VERSION, codes.CLIENT_PUBLIC_KEY_RETURNED_RESPONSE, len(response_payload),
                         response_payload)
 
+    def get_clients_public_keys(self, request, connection):
+        """
+        Retrieves the public keys of several clients at once.
+        :param request: Request containing the ids of the clients whose public keys to retrieve
+        :param connection: connection to client
+        :return: Response
+        """
+        # The payload is a list of client ids
+        payload_size = request.get_payload_size()
+
+        # An oversized payload can't be skipped safely, so close the connection instead of reading it
+        if payload_size > sizes.MAX_PUBLIC_KEYS_REQUEST_IDS * sizes.CLIENT_ID_SIZE:
+            print(f"Payload size: {payload_size} exceeds the maximum of {sizes.MAX_PUBLIC_KEYS_REQUEST_IDS} ids")
+            return None
+
+        # Read the whole payload before validating, so a rejected request doesn't leave bytes on the socket
+        if not self.receive_payload(request, connection):
+            return None
+        raw_ids = request.get_payload()
+
+        self.validate_client_registered(request)
+
+        if payload_size % sizes.CLIENT_ID_SIZE:
+            raise ValueError(f"Payload size: {payload_size} is not a multiple of the client id size")
+        requested_client_ids = [raw_ids[i:i + sizes.CLIENT_ID_SIZE]
+                                for i in range(0, payload_size, sizes.CLIENT_ID_SIZE)]
+
+        # Retrieve all the corresponding clients from the DB at once
+        clients = self.db.get_clients_by_ids(requested_client_ids)
+
+        # Pack an entry per requested id, flagging the ids that weren't found instead of failing the request
+        entries = []
+
+        for client_id in requested_client_ids:
+            client = clients.get(client_id)
+
+            if client:
+                entries.append(PUBLIC_KEY_ENTRY_FORMAT.pack(client_id, 1, client.get_public_key()))
+            else:
+                entries.append(PUBLIC_KEY_ENTRY_FORMAT.pack(client_id, 0, b""))
+        response_payload = b"".join(entries)
+
+        # Return a successful response to the client
+        return Response(SERVER_VERSION, codes.CLIENTS_PUBLIC_KEYS_RETURNED_RESPONSE, len(response_payload),
+                        response_payload)
+
     def send_client_message(self, request, connection):
         """
         Adds a message to the messages table in the DB.
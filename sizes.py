@@ -14,3 +14,6 @@ PUBLIC_KEY_SIZE = 160
 MESSAGE_ID_SIZE = 4
 MESSAGE_TYPE_SIZE = 1
 MESSAGE_CONTENT_SIZE_SIZE = 4
+
+# Get public keys request fields
+MAX_PUBLIC_KEYS_REQUEST_IDS = 10000
@@ -0,0 +1,138 @@
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import time
+import unittest
+
+import codes
+import sizes
+from capture import CaptureWriter, read_capture
+from db import DBConnection
+from replay import RESPONSE_HEADER_FORMAT, RESPONSE_HEADER_SIZE, Replayer, find_free_port, get_frame_offsets, \
+    read_replay_capture, receive_exactly, start_replay_server, summarize
+from response import Response
+
+
+def send_request(sock, client_id, code, payload=b""):
+    """
+    Sends a request to the server and waits for its response.
+    :return: response code and payload
+    """
+    sock.sendall(struct.pack(f"<{sizes.CLIENT_ID_SIZE}sBHI", client_id, 2, code, len(payload)) + payload)
+    return receive_response(sock)
+
+
+def receive_response(sock):
+    """
+    Waits for a response from the server.
+    :return: response code and payload
+    """
+    header = receive_exactly(sock, RESPONSE_HEADER_SIZE)
+    if len(header) < RESPONSE_HEADER_SIZE:
+        raise ConnectionError("The server closed the connection")
+    response_code, payload_size = struct.unpack(RESPONSE_HEADER_FORMAT, header)[1:]
+
+    response_payload = receive_exactly(sock, payload_size)
+    if len(response_payload) < payload_size:
+        raise ConnectionError("The server closed the connection")
+    return response_code, response_payload
+
+
+def register(sock, name):
+    payload = name.encode().ljust(sizes.NAME_SIZE, b"\0") + b"k" * sizes.PUBLIC_KEY_SIZE
+    code, client_id = send_request(sock, b"\0" * sizes.CLIENT_ID_SIZE, codes.REGISTER_REQUEST, payload)
+    assert code == codes.REGISTRATION_SUCCESSFUL_RESPONSE
+    return client_id
+
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.path = os.path.join(work_dir.name, "test.capture")
+
+    def test_frames_round_trip(self):
+        writer = CaptureWriter(self.path)
+        writer.record("a", 100.0, 0.5, b"register", Response(2, codes.REGISTRATION_SUCCESSFUL_RESPONSE, 16, b"i" * 16))
+        writer.record("b", 101.0, 0.25, b"list", Response(2, codes.CLIENTS_LIST_RETURNED_RESPONSE, 4, b"list"))
+        writer.record("a", 102.0, 0.0, b"", None)
+        writer.close()
+
+        frames = read_capture(self.path)
+
+        self.assertEqual([(1, 1), (1, 2), (1, 1)],
+                         [(frame.get_session_id(), frame.get_connection_id()) for frame in frames])
+        self.assertEqual([b"register", b"list", b""], [frame.get_data() for frame in frames])
+        self.assertEqual([codes.REGISTRATION_SUCCESSFUL_RESPONSE, codes.CLIENTS_LIST_RETURNED_RESPONSE, 0],
+                         [frame.get_response_code() for frame in frames])
+
+        # Only registration responses keep their payload
+        self.assertEqual([b"i" * 16, b"", b""], [frame.get_response_payload() for frame in frames])
+        self.assertTrue(frames[2].is_close())
+
+    def test_sessions_skip_downtime(self):
+        for timestamp in (100.0, 500.0):
+            writer = CaptureWriter(self.path)
+            writer.record("a", timestamp, 1.0, b"list", Response(2, codes.CLIENTS_LIST_RETURNED_RESPONSE, 0, None))
+            writer.record("a", timestamp + 1, 1.0, b"list", Response(2, codes.CLIENTS_LIST_RETURNED_RESPONSE, 0, None))
+            writer.close()
+
+        frames = read_capture(self.path)
+
+        self.assertEqual([1, 1, 2, 2], [frame.get_session_id() for frame in frames])
+        self.assertEqual([0, 1, 2, 3], get_frame_offsets(frames))
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.addCleanup(work_dir.cleanup)
+        self.work_dir = work_dir.name
+
+        self.seed_db_path = os.path.join(self.work_dir, "seed.db")
+        DBConnection(self.seed_db_path).connection.close()
+
+    def start_server(self, name, capture_path):
+        db_name = os.path.join(self.work_dir, f"{name}.db")
+        shutil.copyfile(self.seed_db_path, db_name)
+
+        port = find_free_port()
+        start_replay_server(port, db_name, capture_path)
+        return port
+
+    def test_accelerated_replay_maps_registered_ids(self):
+        capture_path = os.path.join(self.work_dir, "original.capture")
+        port = self.start_server("original", capture_path)
+
+        # Register clients on separate connections, then use their ids from another one
+        client_ids = []
+        for i in range(3):
+            with socket.create_connection(("localhost", port)) as sock:
+                client_ids.append(register(sock, f"client{i}"))
+                time.sleep(0.01)
+
+        with socket.create_connection(("localhost", port)) as sock:
+            for client_id in client_ids[1:]:
+                send_request(sock, client_ids[0], codes.GET_CLIENT_PUBLIC_KEY_REQUEST, client_id)
+            send_request(sock, client_ids[0], codes.SEND_CLIENT_MESSAGE_REQUEST,
+                         client_ids[1] + struct.pack("<BI", 3, 0))
+        with socket.create_connection(("localhost", port)) as sock:
+            send_request(sock, client_ids[1], codes.GET_WAITING_MESSAGES_REQUEST)
+
+        frames = read_replay_capture(capture_path, 7)
+        original = summarize(frames)
+        self.assertEqual(0, original["errors"])
+
+        replay_capture_path = os.path.join(self.work_dir, "replay.capture")
+        replayer = Replayer(self.start_server("replay", replay_capture_path), 1000)
+        replayer.replay(frames)
+        replayed = summarize(read_replay_capture(replay_capture_path, original["requests"]))
+
+        self.assertEqual(0, replayer.get_mismatches())
+        self.assertEqual(original["response_codes"], replayed["response_codes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
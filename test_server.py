@@ -0,0 +1,100 @@
+import os
+import socket
+import struct
+import tempfile
+import time
+import unittest
+
+import codes
+import sizes
+from replay import find_free_port, read_replay_capture, start_replay_server
+from test_replay import receive_response, register, send_request
+
+
+def pack_header(client_id, code, payload_size):
+    return struct.pack(f"<{sizes.CLIENT_ID_SIZE}sBHI", client_id, 2, code, payload_size)
+
+
+class GetClientsPublicKeysTest(unittest.TestCase):
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.addCleanup(work_dir.cleanup)
+
+        self.port = find_free_port()
+        self.capture_path = os.path.join(work_dir.name, "test.capture")
+        start_replay_server(self.port, os.path.join(work_dir.name, "test.db"), self.capture_path)
+
+        self.sock = self.connect()
+        self.client_ids = [register(self.sock, f"client{i}") for i in range(2)]
+
+    def connect(self):
+        sock = socket.create_connection(("localhost", self.port))
+        sock.settimeout(5)
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_flags_missing_ids(self):
+        missing_id = b"m" * sizes.CLIENT_ID_SIZE
+        requested_ids = [self.client_ids[1], missing_id, self.client_ids[0]]
+
+        code, payload = send_request(self.sock, self.client_ids[0], codes.GET_CLIENTS_PUBLIC_KEYS_REQUEST,
+                                     b"".join(requested_ids))
+
+        self.assertEqual(codes.CLIENTS_PUBLIC_KEYS_RETURNED_RESPONSE, code)
+        entry_size = sizes.CLIENT_ID_SIZE + 1 + sizes.PUBLIC_KEY_SIZE
+        entries = [struct.unpack(f"<{sizes.CLIENT_ID_SIZE}sB{sizes.PUBLIC_KEY_SIZE}s", payload[i:i + entry_size])
+                   for i in range(0, len(payload), entry_size)]
+        self.assertEqual([(self.client_ids[1], 1, b"k" * sizes.PUBLIC_KEY_SIZE),
+                          (missing_id, 0, b"\0" * sizes.PUBLIC_KEY_SIZE),
+                          (self.client_ids[0], 1, b"k" * sizes.PUBLIC_KEY_SIZE)], entries)
+
+    def test_rejected_requests_keep_the_connection_in_sync(self):
+        # Payload size isn't a multiple of the id size
+        code, _ = send_request(self.sock, self.client_ids[0], codes.GET_CLIENTS_PUBLIC_KEYS_REQUEST,
+                               self.client_ids[1] + b"x" * 15)
+        self.assertEqual(codes.GENERAL_ERROR, code)
+
+        # Unregistered requesting client
+        code, _ = send_request(self.sock, b"u" * sizes.CLIENT_ID_SIZE, codes.GET_CLIENTS_PUBLIC_KEYS_REQUEST,
+                               self.client_ids[1])
+        self.assertEqual(codes.GENERAL_ERROR, code)
+
+        code, payload = send_request(self.sock, self.client_ids[0], codes.GET_CLIENTS_PUBLIC_KEYS_REQUEST,
+                                     self.client_ids[1])
+        self.assertEqual(codes.CLIENTS_PUBLIC_KEYS_RETURNED_RESPONSE, code)
+        self.assertEqual(self.client_ids[1], payload[:sizes.CLIENT_ID_SIZE])
+
+    def test_oversized_request_closes_the_connection(self):
+        self.sock.sendall(pack_header(self.client_ids[0], codes.GET_CLIENTS_PUBLIC_KEYS_REQUEST,
+                                      (sizes.MAX_PUBLIC_KEYS_REQUEST_IDS + 1) * sizes.CLIENT_ID_SIZE))
+
+        self.assertEqual(b"", self.sock.recv(1))
+
+    def test_partial_payload_doesnt_block_other_clients(self):
+        requested_ids = self.client_ids * (sizes.MAX_PUBLIC_KEYS_REQUEST_IDS // 2)
+        request = pack_header(self.client_ids[0], codes.GET_CLIENTS_PUBLIC_KEYS_REQUEST,
+                              len(requested_ids) * sizes.CLIENT_ID_SIZE) + b"".join(requested_ids)
+
+        # Send only part of the payload, then have another client make a request
+        self.sock.sendall(request[:1000])
+        time.sleep(0.1)
+
+        other_sock = self.connect()
+        start_time = time.perf_counter()
+        code, _ = send_request(other_sock, self.client_ids[1], codes.GET_CLIENTS_LIST_REQUEST)
+        self.assertEqual(codes.CLIENTS_LIST_RETURNED_RESPONSE, code)
+        self.assertLess(time.perf_counter() - start_time, 0.5)
+
+        # The rest of the payload completes the pending request
+        self.sock.sendall(request[1000:])
+        code, payload = receive_response(self.sock)
+        self.assertEqual(codes.CLIENTS_PUBLIC_KEYS_RETURNED_RESPONSE, code)
+        self.assertEqual(len(requested_ids) * (sizes.CLIENT_ID_SIZE + 1 + sizes.PUBLIC_KEY_SIZE), len(payload))
+
+        # The parts of the request are captured as a single frame, after the registrations and the list request
+        frames = read_replay_capture(self.capture_path, 4)
+        self.assertEqual(request, frames[-1].get_data())
+
+
+if __name__ == "__main__":
+    unittest.main()